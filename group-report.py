@@ -1,7 +1,8 @@
 import pandas as pd
 import numpy as np
 
-def count_groupings(filename):
+def count_groupings_matrix(filename):
+    """Return (names, count_matrix), where count_matrix[i, j] counts how often names i and j shared a group."""
     df = pd.read_csv(filename)
     iterations = [col for col in df.columns if "Iteration" in col]
     
@@ -10,22 +11,31 @@ def count_groupings(filename):
     num_students = len(names)
     count_matrix = np.zeros((num_students, num_students), dtype=int)
     
-    # Build a dictionary mapping names to indices
-    name_to_index = {name: i for i, name in enumerate(names)}
-    
     # Count occurrences of groupings
     for iteration in iterations:
-        groups = df.groupby(iteration)["Name"].apply(list)
-        for group in groups:
-            for i in range(len(group)):
-                for j in range(i + 1, len(group)):
-                    idx1, idx2 = name_to_index[group[i]], name_to_index[group[j]]
-                    count_matrix[idx1][idx2] += 1
-                    count_matrix[idx2][idx1] += 1
+        # Integer group code per student; blanks and absences ('x') get -1,
+        # which matches no group
+        codes, _ = pd.factorize(df[iteration], sort=False)
+        codes[(df[iteration] == 'x').to_numpy()] = -1
+        if codes.size == 0:
+            continue
+        # Membership matrix: row = student, column = group
+        members = (codes[:, None] == np.arange(codes.max() + 1)).astype(int)
+        # members @ members.T counts, for every pair, whether they shared a group
+        count_matrix += members @ members.T
+    
+    # A student is always in their own group; only pairs are of interest
+    np.fill_diagonal(count_matrix, 0)
     
+    return names, count_matrix
+
+def to_dataframe(names, count_matrix):
+    """Label the count matrix with student names for display."""
+    return pd.DataFrame(count_matrix, index=names, columns=names)
+
+def count_groupings(filename):
     # Convert to DataFrame for readability
-    count_df = pd.DataFrame(count_matrix, index=names, columns=names)
-    return count_df
+    return to_dataframe(*count_groupings_matrix(filename))
 
 if __name__ == "__main__":
     filename = "roster.csv"  # Change to the actual filename
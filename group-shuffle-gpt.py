@@ -1,16 +1,28 @@
+import functools
+import hashlib
+import os
+import re
+import zipfile
 import pandas as pd
-import itertools
-import random
-from collections import defaultdict, Counter
+import numpy as np
+
+# Matches iteration column headers such as "Iteration 3".
+_ITER_RE = re.compile(r'Iteration\s+(\d+)')
 
 # Fixed group names (trees) - reused across iterations.
 GROUP_NAMES = ['cedar', 'cypress', 'spruce', 'pine', 'fir', 'oak', 'maple', 'birch', 'ash', 'elm', 'chestnut']
 
+# Shared NumPy random generator (PCG64) for all shuffling.
+_RNG = np.random.default_rng()
+
 def read_roster(filename):
     """Read the CSV file into a DataFrame with the appropriate encoding and drop extraneous unnamed columns."""
     df = pd.read_csv(filename, encoding='utf-8')  # or try 'cp1252'
     # Drop columns that start with "Unnamed"
     df = df.loc[:, ~df.columns.str.startswith('Unnamed')]
+    # Iteration columns hold a handful of group names, so store them as categoricals
+    for col in df.columns[2:]:
+        df[col] = df[col].astype('category')
     return df
 
 def get_next_iteration_column(df):
@@ -18,18 +30,13 @@ def get_next_iteration_column(df):
     Find the first iteration column that has no group names assigned yet—
     only NaN or 'x' are allowed. If none is found, create a new iteration column.
     """
-    # Identify columns that start with 'Iteration'
-    iteration_cols = [col for col in df.columns[2:] if col.startswith('Iteration')]
+    # Identify the 'Iteration N' columns together with their numbers
+    numbered_cols = [(int(m.group(1)), col) for col in df.columns[2:] if (m := _ITER_RE.match(col))]
     
     # Sort them in numerical order (Iteration 1, Iteration 2, etc.)
     # in case they are out of order
-    def get_iter_num(c):
-        try:
-            return int(c.split()[1])
-        except:
-            return 999999  # fallback if column name is unusual
-    
-    iteration_cols.sort(key=get_iter_num)
+    numbered_cols.sort()
+    iteration_cols = [col for _, col in numbered_cols]
     
     for col in iteration_cols:
         # Get non-null values in this column
@@ -41,8 +48,8 @@ def get_next_iteration_column(df):
             return col
     
     # If no suitable column is found, create a new one
-    if iteration_cols:
-        highest_num = max(get_iter_num(c) for c in iteration_cols)
+    if numbered_cols:
+        highest_num = numbered_cols[-1][0]
         new_iter_num = highest_num + 1
     else:
         new_iter_num = 1
@@ -61,97 +68,232 @@ def extract_absences_and_present(df, iter_col):
     absent_df = df[absent_mask].copy()
     return present_df, absent_df
 
+@functools.lru_cache(maxsize=None)
+def _column_pairings(codes):
+    """
+    Pair counts contributed by a single iteration column, given its group codes in
+    row order as a tuple (see _column_labels). Cached, so reruns in the same process
+    reuse the result; the returned matrix is read-only.
+    """
+    codes = np.array(codes, dtype=np.intp)
+    # Membership matrix: row = student, column = group
+    members = (codes[:, None] == np.arange(codes.max(initial=-1) + 1)).astype(np.int32)
+    counts = members @ members.T
+    # A student is always in their own group; only pairs count
+    np.fill_diagonal(counts, 0)
+    counts.flags.writeable = False
+    return counts
+
+def _column_labels(series):
+    """
+    Hashable form of an iteration column for _column_pairings: its category codes,
+    with -1 for blanks and absences ('x'), since 'x' is not a group.
+    """
+    series = series.astype('category')
+    codes = series.cat.codes.to_numpy().copy()
+    if 'x' in series.cat.categories:
+        codes[codes == series.cat.categories.get_loc('x')] = -1
+    return tuple(codes.tolist())
+
+def _column_hash(series):
+    """Fingerprint of an iteration column's contents, used to validate the pairings cache."""
+    return hashlib.sha1(pd.util.hash_pandas_object(series, index=False).to_numpy().tobytes()).hexdigest()
+
+def _add_column_pairings(pairings, df, col):
+    """
+    Fold one iteration column into pairings in place. Absence marker columns (only
+    'x' or blanks) add nothing and are skipped; returns whether the column was counted.
+    """
+    if df[col].dropna().isin(['x']).all():
+        return False
+    pairings += _column_pairings(_column_labels(df[col]))
+    return True
+
 def compute_past_pairings(df):
     """
-    Build a dictionary with key as a frozenset of two roster numbers and value as
-    the number of times they have been in the same group in previous iterations.
+    Build a matrix counting how many times each pair of students has been in the
+    same group in previous iterations.
+    pairings[i, j] is the count for the students in rows i and j of df.
     """
-    pairings = defaultdict(int)
+    n = len(df)
+    pairings = np.zeros((n, n), dtype=np.int32)
     # Iterate over all grouping columns (skip roster number and name)
     for col in df.columns[2:]:
-        # Skip the absence marker columns (if the entire column is "x" or similar, ignore)
-        if df[col].dropna().isin(['x']).all():
+        _add_column_pairings(pairings, df, col)
+    return pairings
+
+def pairings_cache_path(filename):
+    """Path of the past pairings cache kept next to the roster CSV (roster.csv -> roster.pairings.npz)."""
+    return os.path.splitext(filename)[0] + '.pairings.npz'
+
+def _read_pairings_cache(cache_path, rosters, col_hashes):
+    """
+    Return (pairings, cached_cols, cached_hashes) from the cache file, or None if it is
+    missing, unreadable, or no longer matches the roster and its iteration columns.
+    """
+    try:
+        with np.load(cache_path) as cache:
+            if not np.array_equal(cache['rosters'], rosters):
+                return None
+            cached_cols = cache['cols'].tolist()
+            cached_hashes = cache['hashes'].tolist()
+            if any(col_hashes.get(col) != h for col, h in zip(cached_cols, cached_hashes)):
+                return None
+            return cache['pairings'], cached_cols, cached_hashes
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        # A missing or damaged cache is simply rebuilt
+        return None
+
+def load_past_pairings(df, filename):
+    """
+    Same result as compute_past_pairings, but reuses the matrix cached next to the CSV
+    and only folds in iteration columns that are not in the cache yet.
+    Falls back to a full recompute if the cache is unreadable or the roster or any
+    cached column has changed, and saves the cache whenever it was updated.
+    """
+    cache_path = pairings_cache_path(filename)
+    # Stored as strings so any roster values can be saved without pickling
+    rosters = df['Roster'].to_numpy().astype(str)
+    col_hashes = {col: _column_hash(df[col]) for col in df.columns[2:]}
+    
+    cached = _read_pairings_cache(cache_path, rosters, col_hashes)
+    changed = cached is None
+    if cached is None:
+        n = len(df)
+        cached = np.zeros((n, n), dtype=np.int32), [], []
+    pairings, cached_cols, cached_hashes = cached
+    
+    for col in df.columns[2:]:
+        if col in cached_cols:
             continue
-        # For each group in the column, gather the students
-        groups = df[col].dropna().unique()
-        for group in groups:
-            # Get students in this group for this iteration
-            students_in_group = df[df[col] == group]['Roster'].tolist()
-            # If the CSV does not have "Roster" column name, assume first column is roster number.
-            for pair in itertools.combinations(students_in_group, 2):
-                pairings[frozenset(pair)] += 1
+        # Absence-only columns are not cached, because they are usually
+        # the upcoming iteration that will be filled in later
+        if _add_column_pairings(pairings, df, col):
+            cached_cols.append(col)
+            cached_hashes.append(col_hashes[col])
+            changed = True
+    
+    if changed:
+        # Write to a temporary file first so an interrupted save cannot corrupt the cache
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, pairings=pairings, rosters=rosters,
+                     cols=np.array(cached_cols, dtype=str), hashes=np.array(cached_hashes, dtype=str))
+        os.replace(tmp_path, cache_path)
     return pairings
 
+def build_roster_index(df):
+    """
+    Build an index over the roster numbers in df, so a batch of roster numbers can be
+    translated to row indices (into past_pairings) with roster_index.get_indexer(...).
+    Works for any roster values, not just small integers.
+    """
+    return pd.Index(df['Roster'])
+
 def initial_group_structure(num_students):
     """
     Given the number of present students, find a grouping into groups of 3 and 4 
     such that 3x + 4y = num_students, with y minimized.
     Returns a list of group sizes (e.g., [3, 3, 4]).
-    If no valid grouping exists (for n in {1, 2, 4, 5}), returns an empty list.
+    If no valid grouping exists (for n in {1, 2, 5}), returns an empty list.
     """
-    # Try y from 0 up to the maximum possible number of groups of 4.
-    for y in range(0, num_students // 4 + 1):
-        remaining = num_students - 4 * y
-        if remaining % 3 == 0:
-            x = remaining // 3
-            # Create a list with x groups of 3 and y groups of 4.
-            sizes = [3] * x + [4] * y
-            return sizes
-    return []
+    # Since 4 = 1 (mod 3), 3x + 4y = n needs y = n (mod 3); the smallest such y is n % 3.
+    y = num_students % 3
+    remaining = num_students - 4 * y
+    if remaining < 0:
+        return []
+    x = remaining // 3
+    # Create a list with x groups of 3 and y groups of 4.
+    return [3] * x + [4] * y
 
-def grouping_conflict_score(group, past_pairings):
+def grouping_conflict_score(group_idx, past_pairings):
     """
-    For a given group (list of roster numbers), calculate a conflict score.
+    For a given group (array of row indices into past_pairings), calculate a conflict score.
     Each pair that has been grouped before contributes its count to the score.
     """
-    score = 0
-    for a, b in itertools.combinations(group, 2):
-        score += past_pairings.get(frozenset((a, b)), 0)
-    return score
+    # The block is symmetric, so every pair is counted twice
+    return int(past_pairings[np.ix_(group_idx, group_idx)].sum()) >> 1
 
-def assign_groups(present_students, past_pairings, max_attempts=1000):
+def swap_descent(pairings, group_of, rng=_RNG):
+    """
+    Improve a grouping with local search: repeatedly swap the two students in
+    different groups whose swap lowers the total conflict score the most, until
+    no swap helps. group_of[k] is the group id of student k and is updated in place.
+    """
+    n = len(group_of)
+    group_ids = np.arange(group_of.max() + 1)
+    while True:
+        # Conflict of every student with every group, and with their own group
+        to_group = pairings @ (group_of[:, None] == group_ids)
+        own = to_group[np.arange(n), group_of]
+        # Change in total score if students i and j swap groups:
+        #   (i's conflict with j's group, minus j) - i's conflict with own group
+        # + (j's conflict with i's group, minus i) - j's conflict with own group
+        to_other = to_group[:, group_of]
+        delta = (to_other - own[:, None] - pairings) + (to_other.T - own[None, :] - pairings)
+        delta[group_of[:, None] == group_of[None, :]] = 0
+        # Scan pairs in a random order so ties are broken differently per restart
+        order = rng.permutation(n)
+        delta = delta[np.ix_(order, order)]
+        best = delta.argmin()
+        if delta.flat[best] >= 0:
+            return
+        i, j = order[best // n], order[best % n]
+        group_of[i], group_of[j] = group_of[j], group_of[i]
+
+def assign_groups(present_students, past_pairings, roster_index, max_attempts=1000, restarts=20):
     """
     Attempt to assign groups to present students while minimizing repeat pairings.
-    Uses a random shuffle based approach.
+    max_attempts random shuffles are scored in one batch, then the best few
+    (up to `restarts`) are improved with swap_descent and the best result is kept.
     Returns a tuple (best_assignment, best_total_score).
       - best_assignment is a list of groups (each group is a list of roster numbers).
       - best_total_score is the sum of conflict scores for the assignment.
     """
-    students = present_students['Roster'].tolist()
+    students = present_students['Roster'].to_numpy()
     n = len(students)
-    best_assignment = None
-    best_score = float('inf')
     ideal_sizes = initial_group_structure(n)
     
     if not ideal_sizes or sum(ideal_sizes) != n:
-        # If initial grouping is impossible (e.g., n=1,2,4,5)
+        # If initial grouping is impossible (e.g., n=1,2,5)
         return None, None
     
-    # Try multiple attempts to minimize conflict scores.
-    for attempt in range(max_attempts):
-        random.shuffle(students)
-        assignment = []
-        start = 0
-        valid = True
-        # Form groups according to ideal_sizes order.
-        for size in ideal_sizes:
-            if start + size <= n:
-                group = students[start:start+size]
-                assignment.append(group)
-                start += size
-            else:
-                valid = False
-                break
-        if not valid:
-            continue
-        
-        # Calculate the total conflict score for this assignment.
-        total_score = sum(grouping_conflict_score(group, past_pairings) for group in assignment)
-        if total_score < best_score:
-            best_assignment = assignment
-            best_score = total_score
-            if best_score == 0:  # perfect grouping achieved
-                break
+    # Pairings among the present students only, indexed by position in `students`
+    student_idx = roster_index.get_indexer(students)
+    present_pairings = past_pairings[np.ix_(student_idx, student_idx)]
+    
+    # Group id of each position in a shuffled order, following ideal_sizes,
+    # and which pairs of positions end up in the same group
+    group_slot = np.repeat(np.arange(len(ideal_sizes)), ideal_sizes)
+    same_group_mask = group_slot[:, None] == group_slot[None, :]
+    
+    # Each row is one attempt: a random ordering of the students
+    perms = _RNG.permuted(np.broadcast_to(np.arange(n), (max_attempts, n)), axis=1)
+    
+    # Calculate the total conflict score of every attempt at once.
+    # Each pair shows up twice in the symmetric matrix, hence the halving.
+    pair_scores = present_pairings[perms[:, :, None], perms[:, None, :]]
+    scores = (pair_scores * same_group_mask).sum(axis=(1, 2)) // 2
+    
+    best_group_of = np.empty(n, dtype=np.intp)
+    best_group_of[perms[scores.argmin()]] = group_slot
+    best_score = int(scores.min())
+    
+    # Refine the most promising shuffles, unless a perfect grouping was already found
+    if best_score > 0:
+        for seed in np.argsort(scores, kind='stable')[:restarts]:
+            group_of = np.empty(n, dtype=np.intp)
+            group_of[perms[seed]] = group_slot
+            swap_descent(present_pairings, group_of)
+            same_group = group_of[:, None] == group_of[None, :]
+            total_score = int(present_pairings[same_group].sum()) // 2
+            if total_score < best_score:
+                best_group_of = group_of
+                best_score = total_score
+                if best_score == 0:  # perfect grouping achieved
+                    break
+    
+    best_assignment = [students[best_group_of == g].tolist() for g in range(len(ideal_sizes))]
     return best_assignment, best_score
 
 def assign_group_names(assignment):
@@ -166,38 +308,29 @@ def assign_group_names(assignment):
             name_mapping[roster] = group_name
     return name_mapping
 
-def update_csv_with_assignment(filename, new_assignment, conflict_score, absent_students):
+def update_csv_with_assignment(df, filename, new_assignment, conflict_score, absent_students):
     """
-    Update the CSV file with the new assignment:
+    Update the roster DataFrame with the new assignment and save it to the CSV file:
       - Append a new column for the new iteration with the group names for present students.
       - Log conflicts in a row below if conflict_score > 0.
     """
-    df = pd.read_csv(filename)
     next_col = get_next_iteration_column(df)
     
     # Create a mapping from roster to group name for present students.
     name_mapping = assign_group_names(new_assignment) if new_assignment is not None else {}
+    # Explicitly mark absent students so they are always recorded
+    name_mapping.update(dict.fromkeys(absent_students['Roster'].tolist(), 'x'))
     
-    # For each student in df, update the new iteration column:
-    def assign_value(row):
-        roster = row['Roster']
-        # Explicitly check if the student is absent
-        if roster in absent_students['Roster'].values:
-            return 'x'  # Ensure absent students are always marked
-        return name_mapping.get(roster, pd.NA)
-    
-    df[next_col] = df.apply(assign_value, axis=1)
+    # Update the new iteration column for every student at once:
+    # present students get their group name, anyone unassigned is left blank
+    df[next_col] = pd.Categorical(df['Roster'].map(name_mapping))
     
     # Display conflict log in the terminal instead of appending it to the CSV
     if conflict_score and conflict_score > 0:
         print("\nConflict Log for this iteration:")
         print(f"Total conflict score: {conflict_score}")
 
-    # Save the updated DataFrame without appending the conflict log
-    df.to_csv(filename, index=False)
-
-    
-    # Save the updated CSV
+    # Save the updated CSV (the conflict log is not appended)
     df.to_csv(filename, index=False, encoding='utf-8-sig')
     print(f"Updated CSV saved to {filename}.")
 
@@ -224,9 +357,10 @@ def main():
     print("Absent students detected:")  # Debugging
     print(absent_df)			# Debugging
 
-    past_pairings = compute_past_pairings(df)
+    roster_index = build_roster_index(df)
+    past_pairings = load_past_pairings(df, filename)
     
-    assignment, conflict_score = assign_groups(present_df, past_pairings)
+    assignment, conflict_score = assign_groups(present_df, past_pairings, roster_index)
     if assignment is None:
         print("Grouping is impossible for the number of present students.")
         return
@@ -234,11 +368,12 @@ def main():
     # Print assignment details (optional)
     print("Group Assignment for this iteration:")
     for group in assignment:
-        print(group, "with conflict score:", grouping_conflict_score(group, past_pairings))
+        group_idx = roster_index.get_indexer(group)
+        print(group, "with conflict score:", grouping_conflict_score(group_idx, past_pairings))
     print("Total conflict score for this iteration:", conflict_score)
     
     # Update the CSV with the new assignment and log conflicts if any.
-    update_csv_with_assignment(filename, assignment, conflict_score, absent_df)
+    update_csv_with_assignment(df, filename, assignment, conflict_score, absent_df)
 
 if __name__ == "__main__":
     main()